@@ -1,4 +1,37 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
 import numpy as np
+from numba import njit
+
+# Trial circle positions are generated at one of _N equally-spaced angles,
+# so their cosines and sines can be looked up rather than calculated.
+_N = 4096
+_ang = 2*np.pi * np.arange(_N) / _N
+_COS, _SIN = np.cos(_ang), np.sin(_ang)
+
+@njit(fastmath=True, cache=True)
+def _first_fit(x, y, r, X0, Y0, R, cx, cy, cr, k):
+    """Return the index of the first trial position that can take the circle.
+
+    x, y are the trial centres for a circle of radius r; (X0, Y0) and R are
+    the centre and radius of the large circle; cx, cy, cr hold the centres and
+    radii of the k circles already placed. A trial position is accepted if the
+    circle lies inside the large circle and overlaps none of the placed ones.
+    Returns -1 if there is no such trial position.
+
+    """
+
+    for i in range(len(x)):
+        ex, ey = x[i] - X0, y[i] - Y0
+        if np.sqrt(ex*ex + ey*ey) + r >= R:
+            continue
+        for j in range(k):
+            dx, dy, d = x[i] - cx[j], y[i] - cy[j], r + cr[j]
+            if dx*dx + dy*dy < d*d:
+                break
+        else:
+            return i
+    return -1
 
 class Circle:
     """A little class representing an SVG circle."""
@@ -12,23 +45,22 @@ class Circle:
         self.cx, self.cy, self.r = cx, cy, r
         self.icolour = icolour
 
-    def overlap_with(self, cx, cy, r):
-        """Does the circle overlap with another of radius r at (cx, cy)?"""
+    def svg(self):
+        """Return the circle's SVG element as a line of text."""
 
-        d = np.hypot(cx-self.cx, cy-self.cy)
-        return d < r + self.r
+        return ('<circle cx="{}" cy="{}" r="{}" class="c{}"/>\n'
+            .format(self.cx, self.cy, self.r, self.icolour))
 
     def draw_circle(self, fo):
         """Write the circle's SVG to the output stream, fo."""
 
-        print('<circle cx="{}" cy="{}" r="{}" class="c{}"/>'
-            .format(self.cx, self.cy, self.r, self.icolour), file=fo)
+        fo.write(self.svg())
 
 class Circles:
     """A class for drawing circles-inside-a-circle."""
     
     def __init__(self, width=600, height=600, R=250, n=800, rho_min=0.005,
-                 rho_max=0.05, colours=None):
+                 rho_max=0.05, colours=None, seed=None):
         """Initialize the Circles object.
 
         width, height are the SVG canvas dimensions
@@ -39,6 +71,8 @@ class Circles:
         rho_max is rmax/R, giving the maximum packing circle radius.
         colours is a list of SVG fill colour specifiers to be referenced by
             the class identifiers c<i>. If None, a default palette is set.
+        seed seeds the random number generator (anything accepted by
+            np.random.default_rng, e.g. an int or a SeedSequence).
 
         """
 
@@ -49,9 +83,16 @@ class Circles:
         self.rmin, self.rmax = R * rho_min, R * rho_max
         self.colours = colours or ['#993300', '#a5c916', '#00AA66', '#FF9900']
         self.circles = []
+        # The placed circles' centres and radii are also held in parallel
+        # arrays so that the overlap test can be vectorized; they are grown
+        # as needed if more than n circles end up being placed.
+        self._cx, self._cy, self._cr = np.empty(n), np.empty(n), np.empty(n)
+        self._n_placed = 0
         # The "guard number": we try to place any given circle this number of
         # times before giving up.
         self.guard = 500
+        # The random number generator used for all of the sampling.
+        self._rng = np.random.default_rng(seed)
 
     def preamble(self):
         """The usual SVG preamble, including the image size."""
@@ -91,10 +132,31 @@ class Circles:
         with open(filename, 'w') as self.fo:
             self.preamble()
             self.svg_styles()
-            for circle in self.circles:
-                circle.draw_circle(self.fo)
+            # Build the circles' SVG and write it in one go.
+            self.fo.write(''.join([circle.svg() for circle in self.circles]))
             print('</svg>', file=self.fo)
 
+    def _add_circle(self, cx, cy, r, icolour):
+        """Record a circle of radius r placed at (cx, cy)."""
+
+        k = self._n_placed
+        if k == len(self._cx):
+            # Out of room: double the size of the circle arrays.
+            size = max(1, 2*k)
+            self._cx, self._cy, self._cr = (np.resize(a, size) for a in
+                                            (self._cx, self._cy, self._cr))
+        self._cx[k], self._cy[k], self._cr[k] = cx, cy, r
+        self._n_placed += 1
+        self.circles.append(Circle(cx, cy, r, icolour=icolour))
+
+    def as_arrays(self):
+        """Return arrays of the placed circles' cx, cy, r and colour index."""
+
+        k = self._n_placed
+        icolour = np.array([circle.icolour for circle in self.circles])
+        return (self._cx[:k].copy(), self._cy[:k].copy(), self._cr[:k].copy(),
+                icolour)
+
     def _place_circle(self, r, c_idx=None):
         """Attempt to place a circle of radius r within the larger circle.
         
@@ -107,23 +169,19 @@ class Circles:
             c_idx = range(len(self.colours))
 
         # The guard number: if we don't place a circle within this number
-        # of trials, we give up.
+        # of trials, we give up. Draw all of the trial positions at once,
+        # uniformly on the larger circle's interior.
         guard = self.guard
-        while guard:
-            # Pick a random position, uniformly on the larger circle's interior
-            cr, cphi = ( self.R * np.sqrt(np.random.random()),
-                         2*np.pi * np.random.random() )
-            cx, cy = cr * np.cos(cphi), cr * np.sin(cphi)
-            if cr+r < self.R:
-            # The circle fits inside the larger circle.
-                if not any(circle.overlap_with(self.CX+cx, self.CY+cy, r)
-                                    for circle in self.circles):
-                    # The circle doesn't overlap any other circle: place it.
-                    circle = Circle(cx+self.CX, cy+self.CY, r,
-                                    icolour=np.random.choice(c_idx))
-                    self.circles.append(circle)
-                    return True
-            guard -= 1
+        cr = self.R * np.sqrt(self._rng.random(guard))
+        iphi = self._rng.integers(_N, size=guard)
+        cx, cy = self.CX + cr*_COS[iphi], self.CY + cr*_SIN[iphi]
+        i = _first_fit(cx, cy, r, self.CX, self.CY, self.R,
+                       self._cx, self._cy, self._cr, self._n_placed)
+        if i >= 0:
+            # The first trial position at which the circle fits inside the
+            # larger circle and doesn't overlap any other circle: place it.
+            self._add_circle(cx[i], cy[i], r, icolour=self._rng.choice(c_idx))
+            return True
         # Warn that we reached the guard number of attempts and gave up for
         # for this circle.
         print('guard reached.')
@@ -138,10 +196,13 @@ class Circles:
 
         """
 
-        # First choose a set of n random radii and sort them. We use
-        # random.random() * random.random() to favour small circles.
-        r = self.rmin + (self.rmax - self.rmin) * np.random.random(
-                                self.n) * np.random.random(self.n)
+        # First choose a set of n random radii and sort them (in place, into
+        # descending order). We use random() * random() to favour small
+        # circles.
+        r = self._rng.random(self.n)
+        r *= self._rng.random(self.n)
+        r *= self.rmax - self.rmin
+        r += self.rmin
         r[::-1].sort()
         # Do our best to place the circles, larger ones first.
         nplaced = 0
@@ -151,6 +212,46 @@ class Circles:
         print('{}/{} circles placed successfully.'.format(nplaced, self.n))
                 
 
+def _worker(seed, config):
+    """Pack one set of circles in a worker process.
+
+    Each worker builds its own generator from its SeedSequence child, seed,
+    so the samples are statistically independent of one another.
+
+    """
+
+    cls, kwargs, c_idx = config
+    circles = cls(seed=seed, **kwargs)
+    circles.make_circles(c_idx)
+    return circles.as_arrays()
+
+def make_circles_parallel(n_samples, n_workers=None, cls=Circles, c_idx=None,
+                          seed=None, **kwargs):
+    """Pack n_samples independent sets of circles across worker processes.
+
+    n_workers is the number of processes to use (by default, one per CPU).
+    cls is the packing class to instantiate (Circles or a subclass such as
+        ShapeFill), with the remaining keyword arguments passed to it.
+    c_idx is passed on to make_circles.
+    seed seeds the np.random.SeedSequence from which each sample's seed is
+        spawned.
+    Returns a list of (cx, cy, r, icolour) arrays, one tuple per sample.
+
+    The workers are started with the 'spawn' method rather than by forking:
+    a process forked after Numba's thread pool has started (e.g. because
+    circles have already been packed in the parent) can hang or die. As
+    with any spawned process, the calling script must therefore protect its
+    entry point with an if __name__ == '__main__': guard.
+
+    """
+
+    children = np.random.SeedSequence(seed).spawn(n_samples)
+    config = (cls, kwargs, c_idx)
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+        return list(pool.map(_worker, children, [config] * n_samples))
+
+
 if __name__ == '__main__':
     circles = Circles(n=2000)
     circles.make_circles()
@@ -1,6 +1,33 @@
 from PIL import Image
 import numpy as np
-from circles import Circle, Circles
+from numba import njit
+from circles import Circles
+
+@njit(cache=True)
+def _circle_fits(img, icx, icy, r):
+    """Are all the pixels of img in the circle at (icx, icy), radius r set?
+
+    The circle is assumed to lie within the bounds of img.
+
+    """
+
+    for dx in range(-r, r+1):
+        w = int(np.sqrt(r*r - dx*dx))
+        for dy in range(-w, w+1):
+            if img[icx+dx, icy+dy] == 0:
+                return False
+    return True
+
+@njit(cache=True)
+def _apply_circle_mask(img, icx, icy, stamp):
+    """Zero the pixels of img set in the boolean stamp centred at (icx, icy)."""
+
+    k = stamp.shape[0] // 2
+    nx, ny = img.shape
+    for x in range(max(0, icx-k), min(nx, icx+k+1)):
+        for y in range(max(0, icy-k), min(ny, icy+k+1)):
+            if stamp[x-icx+k, y-icy+k]:
+                img[x, y] = 0
 
 class ShapeFill(Circles):
     """A class for filling a shape with circles."""
@@ -15,10 +42,13 @@ class ShapeFill(Circles):
         The maximum number of circles to pack is given by n
         colours is a list of SVG fill colour specifiers (a default palette is
         used if this argument is not provided).
+        seed seeds the random number generator.
 
         """
 
         self.img_name = img_name
+        # Boolean circle masks, keyed by integer circle radius.
+        self._stamps = {}
         # Read the image and set the image dimensions; hand off to the
         # superclass for other initialization.
         self.read_image(img_name)
@@ -30,8 +60,28 @@ class ShapeFill(Circles):
 
         img = Image.open(img_name).convert('1')
         self.width, self.height = img.width, img.height
-        self.img = 255 - np.array(img.getdata()).reshape(img.height, img.width)
-        self.img = self.img.T
+        # Black pixels (False in the bilevel image) become 255, white ones 0.
+        # The image is stored C-contiguous and indexed as [x, y], so that
+        # the compiled kernels walk along y with unit stride.
+        img = np.where(np.asarray(img), np.uint8(0), np.uint8(255))
+        self.img = np.ascontiguousarray(img.T)
+
+    @property
+    def img(self):
+        """The image array: circles may be placed on its non-zero pixels."""
+
+        return self._img
+
+    @img.setter
+    def img(self, img):
+        """Set the image array and index its non-zero pixels."""
+
+        self._img = img
+        # The flat indexes of the candidate pixels for circle centres: the
+        # first self._ncand of them are live. Pixels covered by a circle are
+        # only dropped from the index when they are next drawn.
+        self._cand = np.flatnonzero(img)
+        self._ncand = len(self._cand)
 
     def _circle_fits(self, icx, icy, r):
         """If I fits, I sits."""
@@ -41,18 +91,23 @@ class ShapeFill(Circles):
         if icx+r >= self.width or icy+r >= self.height:
             return False
 
-        if not all((self.img[icx-r,icy], self.img[icx+r,icy],
-                self.img[icx,icy-r], self.img[icx,icy+r])):
-            return False
-        return True
+        return _circle_fits(self.img, icx, icy, r)
+
+    def _stamp(self, r):
+        """Return the (cached) mask of pixels within r+1 of a circle centre."""
+
+        try:
+            return self._stamps[r]
+        except KeyError:
+            k = r + 1
+            x, y = np.ogrid[-k:k+1, -k:k+1]
+            stamp = self._stamps[r] = x**2 + y**2 <= k**2
+            return stamp
 
     def apply_circle_mask(self, icx, icy, r):
         """Zero all elements of self.img in circle at (icx, icy), radius r."""
 
-        x, y = np.ogrid[0:self.width, 0:self.height]
-        r2 = (r+1)**2
-        mask = (x-icx)**2 + (y-icy)**2 <= r2
-        self.img[mask] = 0
+        _apply_circle_mask(self.img, icx, icy, self._stamp(r))
 
     def _place_circle(self, r, c_idx=None):
         """Attempt to place a circle of radius r within the image figure.
@@ -65,25 +120,25 @@ class ShapeFill(Circles):
         if not c_idx:
             c_idx = range(len(self.colours))
 
-        # Get the coordinates of all non-zero image pixels
-        img_coords = np.nonzero(self.img)
-        if not img_coords:
-            return False
-
         # The guard number: if we don't place a circle within this number
         # of trials, we give up.
         guard = self.guard
         # For this method, r must be an integer. Ensure that it's at least 1.
         r = max(1, int(r))
-        while guard:
+        while guard and self._ncand:
             # Pick a random candidate pixel...
-            i = np.random.randint(len(img_coords[0]))
-            icx, icy = img_coords[0][i], img_coords[1][i]
+            i = self._rng.integers(self._ncand)
+            icx, icy = divmod(self._cand[i], self.height)
+            if not self.img[icx, icy]:
+                # This pixel has since been covered by a circle, so swap it
+                # out of the live part of the candidate index and try again.
+                self._ncand -= 1
+                self._cand[i] = self._cand[self._ncand]
+                continue
             # ... and see if the circle fits there
             if self._circle_fits(icx, icy, r):
                 self.apply_circle_mask(icx, icy, r)
-                circle = Circle(icx, icy, r, icolour=np.random.choice(c_idx))
-                self.circles.append(circle)
+                self._add_circle(icx, icy, r, icolour=self._rng.choice(c_idx))
                 return True
             guard -= 1
         print('guard reached.')